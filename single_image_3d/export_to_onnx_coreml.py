@@ -5,31 +5,52 @@ Export MiDaS to ONNX and optionally to CoreML (free and offline).
 Examples:
   python export_to_onnx_coreml.py --onnx midas.onnx
   python export_to_onnx_coreml.py --onnx midas.onnx --mlmodel MiDaS.mlmodel
+  python export_to_onnx_coreml.py --onnx midas.onnx --int8 --calib-dir examples/
 
 Notes:
 - Uses torch.hub to fetch MiDaS DPT_Large (stable) by default.
 - ONNX opset 12 works for CoreML conversion in most environments.
 - CoreML conversion requires `pip install coremltools onnx`.
+- INT8 quantization (--int8) requires `pip install onnxruntime opencv-python` and a
+  folder of representative photos for calibration. It writes `<onnx>.int8.onnx`
+  next to the FP32 model and compares FP32/INT8 outputs on CPU; a model whose
+  relative error exceeds --int8-max-error is deleted and the export fails.
+  With --mlmodel the CoreML weights are quantized too and checked the same way
+  with ComputeUnit.CPU_ONLY (macOS only) before CPU_AND_NE should be trusted.
 """
 
 import argparse
+import shutil
 import sys
+from pathlib import Path
+
+from midas_common import MIDAS_NORMALIZATION, hub_load, resize_for_inference
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp"}
 
 
 def parse_args():
     ap = argparse.ArgumentParser()
-    ap.add_argument("--model", default="DPT_Large", choices=["DPT_Large", "DPT_Hybrid", "MiDaS_small"], help="MiDaS variant")
+    ap.add_argument("--model", default="DPT_Large", choices=list(MIDAS_NORMALIZATION), help="MiDaS variant")
     ap.add_argument("--onnx", required=True, help="Output ONNX path")
     ap.add_argument("--mlmodel", help="Optional CoreML .mlmodel output path")
     ap.add_argument("--height", type=int, default=384, help="Input height")
     ap.add_argument("--width", type=int, default=384, help="Input width")
-    return ap.parse_args()
+    ap.add_argument("--local-hub-dir", help="torch.hub cache with a pre-downloaded MiDaS repo (no network probe)")
+    ap.add_argument("--int8", action="store_true", help="Also write a static INT8 (QDQ) quantized ONNX model")
+    ap.add_argument("--calib-dir", help="Folder of representative images for INT8 calibration")
+    ap.add_argument("--calib-count", type=int, default=32, help="Max calibration images to use")
+    ap.add_argument("--int8-max-error", type=float, default=0.05, help="Max FP32/INT8 relative depth error before failing")
+    args = ap.parse_args()
+    if args.int8 and not args.calib_dir:
+        ap.error("--int8 requires --calib-dir")
+    return args
 
 
-def export_onnx(model_name: str, h: int, w: int, onnx_path: str):
+def export_onnx(model_name: str, h: int, w: int, onnx_path: str, hub_dir: str | None = None):
     import torch
     print(f"Loading MiDaS model: {model_name}")
-    model = torch.hub.load("intel-isl/MiDaS", model_name)
+    model = hub_load(model_name, hub_dir)
     model.eval()
     dummy = torch.randn(1, 3, h, w)
     print(f"Exporting ONNX → {onnx_path}")
@@ -44,24 +65,184 @@ def export_onnx(model_name: str, h: int, w: int, onnx_path: str):
     )
 
 
-def export_coreml_from_torch(model_name: str, h: int, w: int, mlmodel_path: str):
+def export_coreml_from_torch(
+    model_name: str,
+    h: int,
+    w: int,
+    mlmodel_path: str,
+    int8: bool = False,
+    hub_dir: str | None = None,
+    verify_inputs=None,
+    max_error: float = 0.05,
+):
     print("Converting PyTorch → CoreML (no ONNX)")
     import torch
     import coremltools as ct
-    model = torch.hub.load("intel-isl/MiDaS", model_name)
+    model = hub_load(model_name, hub_dir)
     model.eval()
     example_input = torch.randn(1, 3, h, w)
     traced = torch.jit.trace(model, example_input)
     mlmodel = ct.convert(traced, inputs=[ct.TensorType(name="input", shape=example_input.shape)])
-    mlmodel.save(mlmodel_path)
+    if int8:
+        # Keep the FP32 model around as the reference for the CPU_ONLY check
+        out = Path(mlmodel_path)
+        fp32_path = out.with_name(f"{out.stem}.fp32{out.suffix}")
+        mlmodel.save(str(fp32_path))
+        print("Quantizing CoreML weights to 8 bits")
+        if mlmodel.get_spec().WhichOneof("Type") == "mlProgram":
+            import coremltools.optimize.coreml as cto
+            config = cto.OptimizationConfig(global_config=cto.OpLinearQuantizerConfig(mode="linear_symmetric"))
+            mlmodel = cto.linear_quantize_weights(mlmodel, config=config)
+        else:
+            from coremltools.models.neural_network import quantization_utils
+            mlmodel = quantization_utils.quantize_weights(mlmodel, nbits=8)
+        mlmodel.save(mlmodel_path)
+        try:
+            if verify_inputs:
+                worst = verify_coreml_int8(str(fp32_path), mlmodel_path, verify_inputs)
+                if worst is not None:
+                    check_int8_error(worst, max_error, mlmodel_path)
+        finally:
+            remove_model(fp32_path)
+    else:
+        mlmodel.save(mlmodel_path)
     print(f"Saved CoreML model → {mlmodel_path}")
 
 
+def verify_coreml_int8(fp32_path: str, int8_path: str, inputs):
+    """Compare FP32 vs 8-bit CoreML depth with ComputeUnit.CPU_ONLY. The ANE
+    (CPU_AND_NE) has its own numerics, so the quantization itself is judged on CPU
+    first. CoreML prediction only runs on macOS; elsewhere the check is skipped."""
+    if sys.platform != "darwin":
+        print("Skipping CoreML CPU_ONLY check (CoreML prediction requires macOS)")
+        return None
+    import coremltools as ct
+    cpu_only = ct.ComputeUnit.CPU_ONLY
+    fp32 = ct.models.MLModel(fp32_path, compute_units=cpu_only)
+    int8 = ct.models.MLModel(int8_path, compute_units=cpu_only)
+    worst = 0.0
+    for x in inputs:
+        a = next(iter(fp32.predict({"input": x}).values()))
+        b = next(iter(int8.predict({"input": x}).values()))
+        worst = max(worst, relative_error(a, b))
+    print(f"CoreML 8-bit vs FP32 (CPU_ONLY): max relative error {worst:.4f}")
+    return worst
+
+
+def preprocess(image_path: Path, model_name: str, h: int, w: int):
+    """Load an image and apply the MiDaS resize + normalization → [1,3,h,w] float32."""
+    import cv2
+    import numpy as np
+    img = cv2.imread(str(image_path))
+    if img is None:
+        return None
+    # Same resize rule as predict.fixed_size_transform, so calibration sees serving inputs
+    img = resize_for_inference(cv2.cvtColor(img, cv2.COLOR_BGR2RGB), h, w).astype(np.float32) / 255.0
+    mean, std = MIDAS_NORMALIZATION[model_name]
+    img = (img - np.array(mean, dtype=np.float32)) / np.array(std, dtype=np.float32)
+    return np.ascontiguousarray(img.transpose(2, 0, 1))[None]
+
+
+def calibration_inputs(calib_dir: str, model_name: str, h: int, w: int, limit: int):
+    paths = sorted(p for p in Path(calib_dir).iterdir() if p.suffix.lower() in IMAGE_EXTENSIONS)
+    inputs = [x for x in (preprocess(p, model_name, h, w) for p in paths[:limit]) if x is not None]
+    if not inputs:
+        raise RuntimeError(f"No readable calibration images in {calib_dir}")
+    return inputs
+
+
+def quantize_int8(onnx_path: str, int8_path: str, inputs):
+    """Static per-channel QDQ quantization of the exported model.
+    Only Conv/MatMul are quantized; Softmax and LayerNormalization stay FP32
+    since DPT's attention/normalization layers lose too much accuracy in INT8.
+    """
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self._it = iter({"input": x} for x in inputs)
+
+        def get_next(self):
+            return next(self._it, None)
+
+    prepped_path = str(Path(int8_path).with_suffix(".prep.onnx"))
+    print(f"Quantizing INT8 ({len(inputs)} calibration images) → {int8_path}")
+    quant_pre_process(onnx_path, prepped_path)
+    quantize_static(
+        prepped_path,
+        int8_path,
+        Reader(),
+        quant_format=QuantFormat.QDQ,
+        per_channel=True,
+        activation_type=QuantType.QInt8,
+        weight_type=QuantType.QInt8,
+        op_types_to_quantize=["Conv", "MatMul"],
+    )
+    Path(prepped_path).unlink(missing_ok=True)
+
+
+def relative_error(a, b) -> float:
+    import numpy as np
+    a = np.asarray(a, dtype=np.float32)
+    b = np.asarray(b, dtype=np.float32)
+    return float(np.abs(a - b).max() / (np.abs(a).max() + 1e-8))
+
+
+def remove_model(path):
+    """Delete a model file or package directory (.mlpackage)."""
+    path = Path(path)
+    if path.is_dir():
+        shutil.rmtree(path)
+    else:
+        path.unlink(missing_ok=True)
+
+
+def check_int8_error(worst: float, max_error: float, int8_path: str):
+    """Refuse to leave a badly quantized model behind."""
+    if worst > max_error:
+        remove_model(int8_path)
+        raise RuntimeError(
+            f"INT8 model {int8_path} exceeds --int8-max-error ({worst:.4f} > {max_error}); removed it. "
+            "Try more/more representative calibration images."
+        )
+
+
+def verify_int8(onnx_path: str, int8_path: str, inputs):
+    """Compare FP32 vs INT8 depth on CPU only before trusting accelerated providers."""
+    import onnxruntime as ort
+    providers = ["CPUExecutionProvider"]
+    fp32 = ort.InferenceSession(onnx_path, providers=providers)
+    int8 = ort.InferenceSession(int8_path, providers=providers)
+    worst = 0.0
+    for x in inputs:
+        a = fp32.run(None, {"input": x})[0]
+        b = int8.run(None, {"input": x})[0]
+        worst = max(worst, relative_error(a, b))
+    print(f"INT8 vs FP32 (CPU): max relative error {worst:.4f}")
+    return worst
+
+
 def main():
     args = parse_args()
-    export_onnx(args.model, args.height, args.width, args.onnx)
+    export_onnx(args.model, args.height, args.width, args.onnx, args.local_hub_dir)
+    inputs = None
+    if args.int8:
+        int8_path = str(Path(args.onnx).with_suffix(".int8.onnx"))
+        inputs = calibration_inputs(args.calib_dir, args.model, args.height, args.width, args.calib_count)
+        quantize_int8(args.onnx, int8_path, inputs)
+        check_int8_error(verify_int8(args.onnx, int8_path, inputs), args.int8_max_error, int8_path)
     if args.mlmodel:
-        export_coreml_from_torch(args.model, args.height, args.width, args.mlmodel)
+        export_coreml_from_torch(
+            args.model,
+            args.height,
+            args.width,
+            args.mlmodel,
+            int8=args.int8,
+            hub_dir=args.local_hub_dir,
+            verify_inputs=inputs,
+            max_error=args.int8_max_error,
+        )
 
 
 if __name__ == "__main__":
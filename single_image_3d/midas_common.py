@@ -0,0 +1,50 @@
+"""
+MiDaS constants, hub loading and preprocessing shared by predict.py (serving) and
+export_to_onnx_coreml.py (export/calibration), so both feed the model identically.
+Heavy imports stay inside functions to keep the export CLI fast to start.
+"""
+
+from pathlib import Path
+
+import numpy as np
+
+# Explicit ref: without one torch.hub probes GitHub for the default branch
+MIDAS_REPO = "intel-isl/MiDaS:master"
+
+# Normalization used by the MiDaS hub transforms for each variant
+MIDAS_NORMALIZATION = {
+    "DPT_Large": ((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
+    "DPT_Hybrid": ((0.5, 0.5, 0.5), (0.5, 0.5, 0.5)),
+    "MiDaS_small": ((0.485, 0.456, 0.406), (0.229, 0.224, 0.225)),
+}
+
+
+def resize_for_inference(img_rgb: np.ndarray, h: int, w: int) -> np.ndarray:
+    """Resize an RGB uint8 image to the model input size: area averaging when
+    shrinking, cubic when enlarging."""
+    import cv2
+    if img_rgb.shape[:2] == (h, w):
+        return img_rgb
+    shrink = img_rgb.shape[0] > h or img_rgb.shape[1] > w
+    return cv2.resize(img_rgb, (w, h), interpolation=cv2.INTER_AREA if shrink else cv2.INTER_CUBIC)
+
+
+def hub_cache_dir(repo: str = MIDAS_REPO) -> Path:
+    """Directory torch.hub unpacks `owner/name:ref` into (owner_name_ref)."""
+    import torch
+    return Path(torch.hub.get_dir()) / repo.replace("/", "_").replace(":", "_")
+
+
+def hub_load(model_name: str, hub_dir: str | None = None):
+    """torch.hub.load for MiDaS without a GitHub round-trip on every process start.
+    Once the repo is in the hub cache (`hub_dir`, else torch's default) it is loaded
+    with source="local"; otherwise it is fetched once, skipping the API validation.
+    Checkpoints are cached under the same directory by torch.hub.
+    """
+    import torch
+    if hub_dir:
+        torch.hub.set_dir(hub_dir)
+    local_repo = hub_cache_dir()
+    if local_repo.is_dir():
+        return torch.hub.load(str(local_repo), model_name, source="local")
+    return torch.hub.load(MIDAS_REPO, model_name, trust_repo=True, skip_validation=True)
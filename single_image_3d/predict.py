@@ -5,6 +5,7 @@ Free/open-source: PyTorch (MiDaS), OpenCV, Open3D, trimesh.
 
 Usage:
   python predict.py --input examples/room1.jpg --output out/ --mode single_image
+  python predict.py --input examples/room1.jpg --output out/ --engine onnxrt --onnx out/midas.onnx
 
 Outputs:
   - out/model.obj + out/model.mtl + out/texture.png
@@ -17,6 +18,7 @@ USDZ conversion:
 """
 
 import argparse
+import contextlib
 import json
 import os
 import sys
@@ -24,7 +26,6 @@ from pathlib import Path
 
 import numpy as np
 import cv2
-from PIL import Image
 from rich import print
 
 # Defer heavy imports so CLI help is fast
@@ -34,6 +35,43 @@ import timm
 import open3d as o3d
 import trimesh
 
+from midas_common import MIDAS_NORMALIZATION, hub_load, resize_for_inference
+
+try:
+    from numba import njit, prange
+except ImportError:  # fall back to the vectorized NumPy back-projection
+    njit = None
+
+# Let OpenCV's parallel backend use every core (filters, resize, color conversion)
+cv2.setNumThreads(os.cpu_count() or 1)
+
+# -----------------------------
+# Utility: OpenCV build check
+# -----------------------------
+
+def opencv_cpu_features() -> list[str]:
+    """The 'CPU/HW features' section of cv2.getBuildInformation() (baseline and
+    dispatched SIMD targets such as AVX2 / AVX512_SKX / NEON)."""
+    lines = cv2.getBuildInformation().splitlines()
+    for i, line in enumerate(lines):
+        if "CPU/HW features" in line:
+            indent = len(line) - len(line.lstrip())
+            section = []
+            for sub in lines[i + 1:]:
+                if not sub.strip() or len(sub) - len(sub.lstrip()) <= indent:
+                    break
+                section.append(sub.strip())
+            return section
+    return []
+
+def log_opencv_build():
+    print(
+        f"[green]OpenCV:[/] {cv2.__version__}, threads={cv2.getNumThreads()}, "
+        f"optimized={cv2.useOptimized()}, OMP_NUM_THREADS={os.environ.get('OMP_NUM_THREADS', 'unset')}"
+    )
+    for line in opencv_cpu_features():
+        print(f"  {line}")
+
 # -----------------------------
 # Utility: camera intrinsics
 # -----------------------------
@@ -56,11 +94,34 @@ def infer_intrinsics(img_w: int, img_h: int, focal_px: float | None = None):
 # Depth: MiDaS inference
 # -----------------------------
 
-def load_midas(device: torch.device):
+# MiDaS's useful output resolution is ~384²; inference runs at this size and the
+# depth map is upsampled back to the original image once afterwards.
+INFER_W = INFER_H = 384
+
+def select_device() -> torch.device:
+    return torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+def fixed_size_transform(h: int, w: int, model_name: str = "DPT_Large", device: torch.device = torch.device("cpu")):
+    """Fixed-size replacement for the hub transforms (resize → normalize → tensor).
+    Resizing happens on the uint8 image, which is uploaded as uint8 (4x less
+    transfer than float32) and normalized in place on `device` with cached
+    mean/std. Takes an RGB uint8 image, returns a normalized [1,3,h,w] float tensor.
+    """
+    mean, std = MIDAS_NORMALIZATION[model_name]
+    mean = torch.tensor(mean, dtype=torch.float32, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(std, dtype=torch.float32, device=device).view(1, 3, 1, 1)
+
+    def transform(img_rgb: np.ndarray) -> torch.Tensor:
+        img_rgb = resize_for_inference(img_rgb, h, w)
+        t = torch.from_numpy(img_rgb).permute(2, 0, 1).unsqueeze(0).contiguous()
+        return t.to(device, non_blocking=True).float().div_(255.0).sub_(mean).div_(std)
+
+    return transform
+
+def load_midas(device: torch.device, hub_dir: str | None = None):
     """Load a stable MiDaS DPT model via torch.hub (free).
     Prefer DPT_Large; fall back to Hybrid or Small if needed.
     """
-    transforms = torch.hub.load("intel-isl/MiDaS", "transforms")
     last_error = None
     for model_name in [
         "DPT_Large",      # robust, accurate
@@ -68,95 +129,430 @@ def load_midas(device: torch.device):
         "MiDaS_small",    # fastest
     ]:
         try:
-            model = torch.hub.load("intel-isl/MiDaS", model_name)
+            model = hub_load(model_name, hub_dir)
             model.eval().to(device)
-            # All DPT variants use dpt_transform; MiDaS_small uses small_transform
-            if model_name == "MiDaS_small":
-                transform = transforms.small_transform
-            else:
-                transform = transforms.dpt_transform
+            # DPT variants run at 384², MiDaS_small at 256² (as in the hub transforms)
+            size = 256 if model_name == "MiDaS_small" else INFER_H
+            transform = fixed_size_transform(size, size, model_name, device)
             return model, transform
         except Exception as e:
             last_error = e
             continue
     raise RuntimeError(f"Failed to load MiDaS model variants: {last_error}")
 
+class OnnxMidas:
+    """ONNX Runtime session with the same call contract as the MiDaS module:
+    [N,3,H,W] tensor in, [N,H,W] tensor out.
+    """
+
+    def __init__(self, session):
+        self.session = session
+        self.input_name = session.get_inputs()[0].name
+        self.output_name = session.get_outputs()[0].name
+
+    def input_size(self, default: int = 384):
+        """Spatial input size baked into the export (dynamic dims fall back to `default`)."""
+        shape = self.session.get_inputs()[0].shape
+        h, w = shape[2], shape[3]
+        return (h if isinstance(h, int) else default, w if isinstance(w, int) else default)
+
+    def __call__(self, inp: torch.Tensor) -> torch.Tensor:
+        depth = self.session.run([self.output_name], {self.input_name: inp.cpu().numpy()})[0]
+        return torch.from_numpy(depth).to(inp.device)
+
+def load_onnx_midas(onnx_path: Path, engine: str = "onnxrt", model_name: str = "DPT_Large"):
+    """Load a MiDaS model exported by export_to_onnx_coreml.py into ONNX Runtime.
+    `onnxrt` prefers CUDA and falls back to CPU; `coreml` routes through the
+    CoreML execution provider (ANE/GPU on Apple silicon).
+    Requires `pip install onnxruntime` (or onnxruntime-gpu).
+    """
+    try:
+        import onnxruntime as ort
+    except ImportError as e:
+        raise RuntimeError("onnxruntime is required for --engine onnxrt/coreml: pip install onnxruntime") from e
+
+    if engine == "coreml":
+        wanted = ["CoreMLExecutionProvider", "CPUExecutionProvider"]
+    else:
+        wanted = ["CUDAExecutionProvider", "CPUExecutionProvider"]
+    available = ort.get_available_providers()
+    providers = [p for p in wanted if p in available]
+
+    sess_options = ort.SessionOptions()
+    sess_options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    session = ort.InferenceSession(str(onnx_path), sess_options=sess_options, providers=providers)
+    print(f"[green]ONNX Runtime providers:[/] {session.get_providers()}")
+
+    model = OnnxMidas(session)
+    h, w = model.input_size()
+    return model, fixed_size_transform(h, w, model_name)
+
+PRECISIONS = ["auto", "fp32", "fp16", "bf16"]
+
+def resolve_precision(precision: str, device: torch.device) -> torch.dtype | None:
+    """Autocast dtype for the torch engine (None = plain FP32).
+    auto: FP16 on GPUs (tensor cores), FP32 on CPU. CPU autocast has no fast
+    FP16 path, so an explicit fp16 request on CPU runs as BF16 instead.
+    """
+    if precision == "auto":
+        precision = "fp32" if device.type == "cpu" else "fp16"
+    if precision == "fp16" and device.type == "cpu":
+        print("[yellow]FP16 is not supported for CPU autocast; using BF16[/]")
+        precision = "bf16"
+    return {"fp32": None, "fp16": torch.float16, "bf16": torch.bfloat16}[precision]
+
+class AutocastMidas:
+    """Runs the wrapped MiDaS module under torch.autocast and hands back FP32.
+    Autocast state is thread-local, so it is entered on every call rather than
+    around the caller (the server's batcher runs the model on its own thread).
+    """
+
+    def __init__(self, model, device: torch.device, dtype: torch.dtype):
+        self.model = model
+        self.device_type = device.type
+        self.dtype = dtype
+
+    def __call__(self, inp: torch.Tensor) -> torch.Tensor:
+        with torch.autocast(device_type=self.device_type, dtype=self.dtype):
+            return self.model(inp).float()
+
+def compile_midas(
+    model, transform, device: torch.device, dtype: torch.dtype | None = None, max_batch: int = 1
+):
+    """torch.compile the MiDaS module and trigger compilation with warm-up forwards
+    at the inference resolution (under the same autocast dtype used at serve time).
+    CUDA graphs ("reduce-overhead") are avoided: their outputs are overwritten by the
+    next replay and their trees are per thread, which breaks the server's batcher
+    thread. Warming up at batch 1, 2 and `max_batch` compiles the single-image graph
+    plus one with a dynamic batch dimension, so no batch size recompiles under load.
+    Callers must use the same grad mode as the warm-up (no_grad, not inference_mode).
+    Compilation is lazy, so failures surface during the warm-up; any error falls
+    back to the eager module.
+    """
+    if not hasattr(torch, "compile"):
+        return model
+    try:
+        compiled = torch.compile(model, mode="default", fullgraph=False)
+        dummy = transform(np.zeros((INFER_H, INFER_W, 3), dtype=np.uint8)).to(device)
+        autocast = (
+            torch.autocast(device_type=device.type, dtype=dtype) if dtype is not None else contextlib.nullcontext()
+        )
+        with torch.no_grad(), autocast:
+            for batch in sorted({1, min(2, max_batch), max_batch}):
+                compiled(dummy.expand(batch, -1, -1, -1).contiguous())
+        print("[green]MiDaS compiled with torch.compile[/]")
+        return compiled
+    except Exception as e:
+        print(f"[yellow]torch.compile failed, using eager MiDaS:[/] {e}")
+        return model
+
+def load_depth_model(
+    engine: str = "torch",
+    onnx_path: Path | None = None,
+    model_name: str = "DPT_Large",
+    precision: str = "auto",
+    compile: bool = False,
+    hub_dir: str | None = None,
+    max_batch: int = 1,
+):
+    """Load the depth model for the requested engine. Returns (model, transform, device);
+    ONNX Runtime engines hand back CPU tensors, so their device is always CPU.
+    `precision`, `compile` and `hub_dir` apply to the torch engine only; compiling
+    costs seconds up front, so it pays off in long-lived processes like the server.
+    `max_batch` is the largest batch the compiled model is warmed up for.
+    """
+    if engine == "torch":
+        device = select_device()
+        model, transform = load_midas(device, hub_dir)
+        dtype = resolve_precision(precision, device)
+        if compile:
+            model = compile_midas(model, transform, device, dtype, max_batch)
+        if dtype is not None:
+            model = AutocastMidas(model, device, dtype)
+        print(f"[green]Precision:[/] {dtype or torch.float32}")
+        return model, transform, device
+    if onnx_path is None:
+        raise ValueError(f"--engine {engine} requires an exported ONNX model (--onnx)")
+    model, transform = load_onnx_midas(onnx_path, engine, model_name)
+    return model, transform, torch.device("cpu")
+
+DEPTH_FILTERS = ["guided", "bilateral", "none"]
+
+def filter_guide(image_bgr: np.ndarray) -> np.ndarray:
+    """Grayscale [0,1] float32 guide image for the guided depth filter."""
+    return cv2.cvtColor(image_bgr, cv2.COLOR_BGR2GRAY).astype(np.float32) / 255.0
+
+def filter_depth(
+    depth: np.ndarray, image_bgr: np.ndarray, method: str = "guided", guide: np.ndarray | None = None
+) -> np.ndarray:
+    """Edge-preserving smoothing of a normalized depth map.
+    guided: O(N) guided filter steered by the image (needs opencv-contrib's ximgproc);
+    `guide` may be passed in if already computed via filter_guide.
+    bilateral: 9x9 non-separable bilateral on depth alone (slow, kept for comparison).
+    """
+    if method == "guided" and not hasattr(cv2, "ximgproc"):
+        print("[yellow]cv2.ximgproc unavailable (install opencv-contrib-python); using bilateral filter[/]")
+        method = "bilateral"
+    if method == "guided":
+        if guide is None:
+            guide = filter_guide(image_bgr)
+        return cv2.ximgproc.guidedFilter(guide=guide, src=depth, radius=4, eps=1e-3)
+    if method == "bilateral":
+        return cv2.bilateralFilter(depth, d=9, sigmaColor=0.1, sigmaSpace=7)
+    return depth
+
 @torch.no_grad()
-def estimate_depth(model, transform, image_bgr: np.ndarray, device: torch.device) -> np.ndarray:
-    """Run MiDaS to get relative depth. Returns float32 HxW depth map normalized."""
+def estimate_depth(model, transform, image_bgr: np.ndarray, device: torch.device, depth_filter: str = "guided") -> np.ndarray:
+    """Run MiDaS to get relative depth. Returns float32 HxW depth map normalized.
+    `model` may be the MiDaS module or any callable with the same [N,3,H,W] → [N,H,W]
+    contract (e.g. the server's batching front-end).
+    """
     img_rgb = cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)
     inp = transform(img_rgb).to(device)
     pred = model(inp)
-    depth = torch.nn.functional.interpolate(
+    pred = torch.nn.functional.interpolate(
         pred.unsqueeze(1), size=img_rgb.shape[:2], mode="bicubic", align_corners=False
-    ).squeeze().cpu().numpy()
-    # Normalize depth to [0,1]
-    depth = (depth - depth.min()) / (depth.max() - depth.min() + 1e-8)
-    # Post-process: bilateral filter to smooth while preserving edges
-    depth = cv2.bilateralFilter(depth.astype(np.float32), d=9, sigmaColor=0.1, sigmaSpace=7)
+    ).squeeze()
+    # Normalize depth to [0,1] on the model's device
+    pred_min, pred_max = pred.aminmax()
+    pred = (pred - pred_min) / (pred_max - pred_min + 1e-8)
+
+    guide = None
+    if device.type == "cuda":
+        # Copy back as FP16 (half the PCIe payload; ample for [0,1] depth) on a
+        # side stream, overlapping the transfer with the host-side guide prep.
+        pred_half = pred.to(torch.float16).contiguous()
+        host = torch.empty(pred_half.shape, dtype=torch.float16, pin_memory=True)
+        copy_stream = torch.cuda.Stream(device)
+        copy_stream.wait_stream(torch.cuda.current_stream(device))
+        with torch.cuda.stream(copy_stream):
+            host.copy_(pred_half, non_blocking=True)
+            pred_half.record_stream(copy_stream)
+        if depth_filter == "guided":
+            guide = filter_guide(image_bgr)
+        copy_stream.synchronize()
+        depth = host.numpy().astype(np.float32)
+    else:
+        depth = pred.float().cpu().numpy()
+    # Post-process: smooth while preserving edges
+    depth = filter_depth(depth, image_bgr, depth_filter, guide)
     return depth.astype(np.float32)
 
 # -----------------------------
 # Back-projection → point cloud
 # -----------------------------
 
-def depth_to_pointcloud(depth: np.ndarray, K: np.ndarray) -> o3d.geometry.PointCloud:
-    H, W = depth.shape
-    fx, fy = K[0, 0], K[1, 1]
-    cx, cy = K[0, 2], K[1, 2]
+# Open3D tensor geometry runs on CUDA when the build supports it
+O3D_DEVICE = o3d.core.Device("CUDA:0" if o3d.core.cuda.is_available() else "CPU:0")
 
-    us = np.arange(W)
-    vs = np.arange(H)
-    u, v = np.meshgrid(us, vs)
+# Scale relative depth into meters (heuristic). User can override later.
+DEPTH_SCALE_M = 3.0  # assume ~3m max depth for indoor scenes
 
-    z = depth.copy()
-    # Scale relative depth into meters (heuristic). User can override later.
-    z = z * 3.0  # assume ~3m max depth for indoor scenes
-    x = (u - cx) * z / fx
-    y = (v - cy) * z / fy
+# Near-zero depth cut-off. Kept float32 so NumPy and numba compare in the same precision
+# and the points and normals masks in depth_to_pointcloud always agree.
+MIN_DEPTH_M = np.float32(1e-3)
 
-    pts = np.stack([x, y, z], axis=-1).reshape(-1, 3)
-    # remove invalid/near-zero depth
-    mask = z.reshape(-1) > 1e-3
-    pts = pts[mask]
+def _unproject_numpy(depth: np.ndarray, fx, fy, cx, cy, scale) -> np.ndarray:
+    H, W = depth.shape
+    # float32 pixel grids; everything below stays float32 to halve memory traffic
+    v_idx, u_idx = np.indices((H, W), dtype=np.float32)
+
+    z = depth.ravel() * scale
+    u = u_idx.ravel()
+    v = v_idx.ravel()
+
+    # Write x/y/z straight into one (N,3) buffer
+    pts = np.empty((H * W, 3), dtype=np.float32)
+    pts[:, 2] = z
+    np.subtract(u, cx, out=u)
+    np.multiply(u, z, out=pts[:, 0])
+    pts[:, 0] /= fx
+    np.subtract(v, cy, out=v)
+    np.multiply(v, z, out=pts[:, 1])
+    pts[:, 1] /= fy
 
-    pcd = o3d.geometry.PointCloud(o3d.utility.Vector3dVector(pts))
+    # remove invalid/near-zero depth
+    return pts[z > MIN_DEPTH_M]
+
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _unproject(depth, fx, fy, cx, cy, scale):
+        """Two-pass parallel back-projection: count valid pixels per row, then
+        each row writes its points at a precomputed offset (row-major order)."""
+        H, W = depth.shape
+        counts = np.zeros(H + 1, dtype=np.int64)
+        for v in prange(H):
+            c = 0
+            for u in range(W):
+                if depth[v, u] * scale > MIN_DEPTH_M:
+                    c += 1
+            counts[v + 1] = c
+        offsets = np.cumsum(counts)
+
+        pts = np.empty((offsets[H], 3), dtype=np.float32)
+        for v in prange(H):
+            k = offsets[v]
+            y = (v - cy) / fy
+            for u in range(W):
+                z = depth[v, u] * scale
+                if z > MIN_DEPTH_M:
+                    pts[k, 0] = (u - cx) / fx * z
+                    pts[k, 1] = y * z
+                    pts[k, 2] = z
+                    k += 1
+        return pts
+else:
+    _unproject = _unproject_numpy
+
+def _analytic_normals(depth: np.ndarray, K: np.ndarray) -> np.ndarray:
+    """Per-pixel unit normals of the back-projected depth surface, (H*W,3), facing the camera.
+    With P(u,v) = z * ((u-cx)/fx, (v-cy)/fy, 1), the cross product P_v x P_u is a
+    positive multiple of (fx*z_u, fy*z_v, -(z + (u-cx)*z_u + (v-cy)*z_v)),
+    so central differences of z replace a KD-tree neighbourhood fit.
+    """
+    H, W = depth.shape
+    z = depth.astype(np.float32) * np.float32(DEPTH_SCALE_M)
+    z_v, z_u = np.gradient(z)
+    v_idx, u_idx = np.indices((H, W), dtype=np.float32)
+
+    n = np.empty((H, W, 3), dtype=np.float32)
+    n[..., 0] = K[0, 0] * z_u
+    n[..., 1] = K[1, 1] * z_v
+    n[..., 2] = -(z + (u_idx - K[0, 2]) * z_u + (v_idx - K[1, 2]) * z_v)
+    n /= np.linalg.norm(n, axis=2, keepdims=True) + 1e-12
+    return n.reshape(-1, 3)
+
+def depth_to_pointcloud(depth: np.ndarray, K: np.ndarray) -> o3d.t.geometry.PointCloud:
+    fx, fy = np.float32(K[0, 0]), np.float32(K[1, 1])
+    cx, cy = np.float32(K[0, 2]), np.float32(K[1, 2])
+    depth = np.ascontiguousarray(depth, dtype=np.float32)
+    pts = _unproject(depth, fx, fy, cx, cy, np.float32(DEPTH_SCALE_M))
+    # Same validity test and row-major order as _unproject
+    normals = _analytic_normals(depth, K)[depth.ravel() * np.float32(DEPTH_SCALE_M) > MIN_DEPTH_M]
+    # Tensor geometry wraps the float32 buffers directly (no Vector3dVector float64 copy)
+    pcd = o3d.t.geometry.PointCloud(O3D_DEVICE)
+    pcd.point.positions = o3d.core.Tensor(pts, device=O3D_DEVICE)
+    pcd.point.normals = o3d.core.Tensor(normals, device=O3D_DEVICE)
     return pcd
 
 # -----------------------------
 # Point cloud cleanup
 # -----------------------------
 
-def clean_pointcloud(pcd: o3d.geometry.PointCloud):
-    # voxel downsample
-    pcd = pcd.voxel_down_sample(voxel_size=0.01)
-    # outlier removal
-    pcd, _ = pcd.remove_statistical_outlier(nb_neighbors=20, std_ratio=2.0)
-    pcd.estimate_normals(
-        search_param=o3d.geometry.KDTreeSearchParamHybrid(radius=0.05, max_nn=30)
-    )
+OUTLIER_MAX_POINTS = 50_000
+
+def clean_pointcloud(pcd: o3d.t.geometry.PointCloud) -> o3d.t.geometry.PointCloud:
+    # voxel downsample; grow the voxel with point count so high-res inputs
+    # don't hand millions of points to the KD-tree and Poisson steps
+    n_points = len(pcd.point.positions)
+    voxel_size = max(0.005, 0.015 * np.sqrt(n_points / 1e6))
+    pcd = pcd.voxel_down_sample(voxel_size=voxel_size)
+    # outlier removal is a KD-tree query per point; run it on a bounded working set
+    if len(pcd.point.positions) > OUTLIER_MAX_POINTS:
+        pcd = pcd.uniform_down_sample(int(np.ceil(len(pcd.point.positions) / OUTLIER_MAX_POINTS)))
+    pcd, _ = pcd.remove_statistical_outliers(nb_neighbors=20, std_ratio=2.0)
+    if "normals" in pcd.point:
+        # analytic normals from depth_to_pointcloud; voxel averaging shortens them
+        pcd.normalize_normals()
+    else:
+        pcd.estimate_normals(max_nn=30, radius=0.05)
     return pcd
 
 # -----------------------------
 # Meshing
 # -----------------------------
 
-def reconstruct_mesh(pcd: o3d.geometry.PointCloud):
-    mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
-        pcd, depth=8
+MESHERS = ["grid", "poisson", "bpa"]
+MAX_FACES = 150_000
+
+def mesh_from_depth(
+    depth: np.ndarray,
+    K: np.ndarray,
+    mask: np.ndarray | None = None,
+    max_faces: int = MAX_FACES,
+    max_rel_jump: float = 0.05,
+) -> o3d.geometry.TriangleMesh:
+    """Triangulate the depth map directly: two triangles per pixel quad.
+    The depth image is already an organized grid, so no surface solve is needed.
+    The grid is resampled (nearest pixel, aspect kept) to the largest size whose
+    2*(Hs-1)*(Ws-1) faces fit `max_faces`, and quads spanning a depth discontinuity
+    (relative jump > `max_rel_jump`) or an invalid pixel are dropped.
+    """
+    H, W = depth.shape
+    Hs, Ws = H, W
+    if 2 * (H - 1) * (W - 1) > max_faces:
+        scale = np.sqrt(max_faces / (2.0 * H * W))
+        Hs, Ws = max(2, int(H * scale)), max(2, int(W * scale))
+    # Nearest-pixel sampling: interpolating would blend depth across discontinuities
+    rows = np.round(np.linspace(0, H - 1, Hs)).astype(np.intp)
+    cols = np.round(np.linspace(0, W - 1, Ws)).astype(np.intp)
+    z = depth[np.ix_(rows, cols)].astype(np.float32) * np.float32(DEPTH_SCALE_M)
+    valid = z > MIN_DEPTH_M
+    if mask is not None:
+        valid &= mask[np.ix_(rows, cols)]
+
+    # Vertices at the sampled pixel positions in original image coordinates,
+    # so compute_uv with the full-resolution K still lines up.
+    v_idx, u_idx = np.meshgrid(rows.astype(np.float32), cols.astype(np.float32), indexing="ij")
+    verts = np.empty((Hs * Ws, 3), dtype=np.float32)
+    verts[:, 0] = ((u_idx - K[0, 2]) * z / K[0, 0]).ravel()
+    verts[:, 1] = ((v_idx - K[1, 2]) * z / K[1, 1]).ravel()
+    verts[:, 2] = z.ravel()
+
+    # Top-left corner index of every quad; wound so normals face the camera (-z)
+    i = np.arange(Hs * Ws).reshape(Hs, Ws)[:-1, :-1].ravel()
+    faces = np.concatenate([
+        np.stack([i, i + Ws, i + 1], axis=1),
+        np.stack([i + 1, i + Ws, i + Ws + 1], axis=1),
+    ])
+
+    zf = z.ravel()
+    corner_z = zf[faces]
+    keep = valid.ravel()[faces].all(axis=1)
+    keep &= (corner_z.max(axis=1) - corner_z.min(axis=1)) < max_rel_jump * corner_z.min(axis=1)
+    faces = faces[keep]
+
+    # Drop vertices no face references and compact indices
+    used = np.zeros(len(verts), dtype=bool)
+    used[faces] = True
+    remap = np.cumsum(used) - 1
+    verts = verts[used]
+    faces = remap[faces]
+
+    mesh = o3d.geometry.TriangleMesh(
+        o3d.utility.Vector3dVector(verts), o3d.utility.Vector3iVector(faces.astype(np.int32))
     )
-    # crop mesh to bounding box of points
-    bbox = pcd.get_axis_aligned_bounding_box()
-    mesh = mesh.crop(bbox)
+    mesh.compute_vertex_normals()
+    return mesh
+
+def reconstruct_mesh(pcd: o3d.t.geometry.PointCloud, method: str = "poisson"):
+    # Poisson / ball pivoting only exist for legacy geometry
+    pcd = pcd.to_legacy()
+    if method == "bpa":
+        # Ball pivoting with radii around the mean point spacing
+        spacing = float(np.mean(pcd.compute_nearest_neighbor_distance()))
+        radii = o3d.utility.DoubleVector([spacing, 2 * spacing, 4 * spacing])
+        mesh = o3d.geometry.TriangleMesh.create_from_point_cloud_ball_pivoting(pcd, radii)
+    else:
+        # Octree memory grows ~8^depth; clean_pointcloud caps the cloud at
+        # OUTLIER_MAX_POINTS, for which depth 7 is plenty
+        mesh, densities = o3d.geometry.TriangleMesh.create_from_point_cloud_poisson(
+            pcd, depth=7
+        )
+        # crop mesh to bounding box of points
+        bbox = pcd.get_axis_aligned_bounding_box()
+        mesh = mesh.crop(bbox)
     mesh.remove_degenerate_triangles()
     mesh.remove_duplicated_triangles()
     mesh.remove_duplicated_vertices()
     mesh.remove_non_manifold_edges()
     mesh = mesh.filter_smooth_simple(number_of_iterations=1)
-    # simplify target triangle count
-    target = min(len(mesh.triangles), 150_000)
-    if target > 0:
-        mesh = mesh.simplify_quadric_decimation(target)
+    # simplify to the triangle budget in ~10% steps (smoother than one large step)
+    while len(mesh.triangles) > MAX_FACES:
+        n_tri = len(mesh.triangles)
+        mesh = mesh.simplify_quadric_decimation(max(MAX_FACES, int(n_tri * 0.9)))
+        if len(mesh.triangles) >= n_tri:
+            break
     mesh.compute_vertex_normals()
     return mesh
 
@@ -169,36 +565,84 @@ def compute_uv(mesh: o3d.geometry.TriangleMesh, K: np.ndarray, img_w: int, img_h
     fx, fy = K[0, 0], K[1, 1]
     cx, cy = K[0, 2], K[1, 2]
 
-    X, Y, Z = verts[:, 0], verts[:, 1], verts[:, 2]
-    # Project: u = fx * X/Z + cx; v = fy * Y/Z + cy
+    # Contiguous per-axis copies (SoA): the strided columns of the Nx3 array
+    # would make every ufunc below gather instead of streaming.
+    X = np.ascontiguousarray(verts[:, 0])
+    Y = np.ascontiguousarray(verts[:, 1])
+    Z = np.ascontiguousarray(verts[:, 2])
+
+    # Project: u = fx * X/Z + cx; v = fy * Y/Z + cy, normalized to [0,1].
+    # Computed in place to avoid per-step temporaries.
     eps = 1e-6
-    u = fx * X / (Z + eps) + cx
-    v = fy * Y / (Z + eps) + cy
-    # Normalize to [0,1]
-    u = np.clip(u / img_w, 0, 1)
-    v = np.clip(v / img_h, 0, 1)
+    Z += eps
+    u = np.multiply(X, fx / img_w, out=X)
+    u /= Z
+    u += cx / img_w
+    v = np.multiply(Y, fy / img_h, out=Y)
+    v /= Z
+    v += cy / img_h
+    np.clip(u, 0, 1, out=u)
+    np.clip(v, 0, 1, out=v)
     # Invert v for typical image origin differences
-    v = 1.0 - v
-    uv = np.stack([u, v], axis=1)
-    return uv.astype(np.float32)
+    np.subtract(1.0, v, out=v)
+
+    uv = np.empty((len(verts), 2), dtype=np.float32)
+    uv[:, 0] = u
+    uv[:, 1] = v
+    return uv
 
 # -----------------------------
 # Export: OBJ+MTL+PNG and GLB
 # -----------------------------
 
-def export_obj_glb(mesh: o3d.geometry.TriangleMesh, uv: np.ndarray, texture_path: Path, out_dir: Path):
-    out_dir.mkdir(parents=True, exist_ok=True)
-    obj_path = out_dir / "model.obj"
-    mtl_path = out_dir / "model.mtl"
-    glb_path = out_dir / "model.glb"
+TEXTURE_NAME = "texture.png"
+MTL_NAME = "model.mtl"
+# A ~150k-face mesh can't resolve more texels than this; larger photos only bloat the GLB
+MAX_TEXTURE_SIZE = 2048
+
+def _format_rows(row_fmt: str, arr: np.ndarray, chunk: int = 65_536):
+    """Format a 2-D array with one printf-style call per chunk of rows.
+    np.savetxt formats row by row in Python; this keeps the loop in C."""
+    for start in range(0, len(arr), chunk):
+        block = arr[start:start + chunk]
+        yield (row_fmt * len(block)) % tuple(block.ravel().tolist())
+
+def format_mtl(texture_name: str = TEXTURE_NAME) -> str:
+    return (
+        "newmtl material0\n"
+        "Ka 1.0 1.0 1.0\nKd 1.0 1.0 1.0\nKs 0.0 0.0 0.0\n"
+        "d 1.0\nillum 1\n"
+        f"map_Kd {texture_name}\n"
+    )
 
+def format_obj(vertices: np.ndarray, uv: np.ndarray, faces: np.ndarray, mtl_name: str = MTL_NAME) -> str:
+    """Textured OBJ text. Vertex and UV indices coincide (one vt per v)."""
+    # f v/vt per corner: repeat each 1-based index for the vt slot
+    face_idx = np.repeat(faces.astype(np.int64) + 1, 2, axis=1)
+    return "".join([
+        f"mtllib {mtl_name}\nusemtl material0\n",
+        *_format_rows("v %.6f %.6f %.6f\n", vertices),
+        *_format_rows("vt %.6f %.6f\n", uv),
+        *_format_rows("f %d/%d %d/%d %d/%d\n", face_idx),
+    ])
+
+def export_obj_glb(mesh: o3d.geometry.TriangleMesh, uv: np.ndarray, image_bgr: np.ndarray):
+    """Encode the textured mesh in memory. Returns (glb_bytes, obj_str, tex_bytes);
+    the OBJ references MTL_NAME / TEXTURE_NAME (see save_outputs)."""
     # Convert Open3D mesh to trimesh
     vertices = np.asarray(mesh.vertices)
     faces = np.asarray(mesh.triangles)
 
-    # Load texture image
-    tex_img = Image.open(texture_path).convert("RGB")
-    tex_arr = np.array(tex_img)
+    # Texture from the original image, capped at MAX_TEXTURE_SIZE (UVs are normalized,
+    # so any texture resolution maps the same way)
+    tex_bgr = image_bgr
+    scale = MAX_TEXTURE_SIZE / max(image_bgr.shape[:2])
+    if scale < 1.0:
+        tex_w = max(1, round(image_bgr.shape[1] * scale))
+        tex_h = max(1, round(image_bgr.shape[0] * scale))
+        tex_bgr = cv2.resize(image_bgr, (tex_w, tex_h), interpolation=cv2.INTER_AREA)
+    tex_arr = cv2.cvtColor(tex_bgr, cv2.COLOR_BGR2RGB)
+    tex_bytes = cv2.imencode(".png", tex_bgr)[1].tobytes()
 
     # Construct Trimesh with UVs + texture
     tm = trimesh.Trimesh(vertices=vertices, faces=faces, process=False)
@@ -210,80 +654,108 @@ def export_obj_glb(mesh: o3d.geometry.TriangleMesh, uv: np.ndarray, texture_path
     )
     tm.visual.material = material
 
-    # Export OBJ (+MTL)
-    obj_str = trimesh.exchange.obj.export_obj(tm, include_texture=True)
-    with open(obj_path, "w", encoding="utf-8") as f:
-        f.write(obj_str)
-    # Write texture alongside
-    tex_out = out_dir / "texture.png"
-    tex_img.save(tex_out)
+    # OBJ text (MTL is written alongside by save_outputs)
+    obj_str = format_obj(vertices, uv, faces)
 
     # Export GLB (binary glTF)
     glb = trimesh.exchange.gltf.export_glb(tm)
     glb_bytes = glb if isinstance(glb, (bytes, bytearray)) else bytes(glb)
-    with open(glb_path, "wb") as f:
-        f.write(glb_bytes)
 
-    return obj_path, glb_path, tex_out
+    return glb_bytes, obj_str, tex_bytes
 
 # -----------------------------
 # Stats
 # -----------------------------
 
-def write_stats(mesh: o3d.geometry.TriangleMesh, out_dir: Path):
-    stats = {
+def mesh_stats(mesh: o3d.geometry.TriangleMesh):
+    bbox = mesh.get_axis_aligned_bounding_box()
+    return {
         "vertices": int(len(mesh.vertices)),
         "faces": int(len(mesh.triangles)),
         "bbox": {
-            "min": list(np.asarray(mesh.get_axis_aligned_bounding_box().get_min_bound())),
-            "max": list(np.asarray(mesh.get_axis_aligned_bounding_box().get_max_bound())),
+            "min": np.asarray(bbox.get_min_bound()).tolist(),
+            "max": np.asarray(bbox.get_max_bound()).tolist(),
         },
     }
-    with open(out_dir / "stats.json", "w") as f:
+
+def save_outputs(out_dir: Path, glb_bytes: bytes, obj_str: str, tex_bytes: bytes, stats: dict):
+    """Write model.obj + model.mtl + texture.png, model.glb and stats.json."""
+    out_dir.mkdir(parents=True, exist_ok=True)
+    obj_path = out_dir / "model.obj"
+    glb_path = out_dir / "model.glb"
+    tex_path = out_dir / TEXTURE_NAME
+    stats_path = out_dir / "stats.json"
+    obj_path.write_text(obj_str, encoding="utf-8")
+    (out_dir / MTL_NAME).write_text(format_mtl(), encoding="utf-8")
+    tex_path.write_bytes(tex_bytes)
+    glb_path.write_bytes(glb_bytes)
+    with open(stats_path, "w") as f:
         json.dump(stats, f, indent=2)
-    return stats
+    return obj_path, glb_path, tex_path, stats_path
 
 # -----------------------------
 # Main CLI
 # -----------------------------
 
-def run_single_image(input_path: Path, output_dir: Path):
-    image_bgr = cv2.imread(str(input_path))
-    if image_bgr is None:
-        raise FileNotFoundError(f"Failed to read image: {input_path}")
+def generate_model(
+    image_bgr: np.ndarray,
+    model,
+    transform,
+    device: torch.device,
+    depth_filter: str = "guided",
+    mesher: str = "grid",
+):
+    """Run depth → mesh → texture on an already-decoded BGR image, entirely in memory.
+    The MiDaS model is passed in so long-lived callers (server.py) load it once.
+    Returns (glb_bytes, obj_str, tex_bytes, stats).
+    """
     H, W = image_bgr.shape[:2]
 
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"[green]Device:[/] {device}")
-    model, transform = load_midas(device)
-
-    depth = estimate_depth(model, transform, image_bgr, device)
+    image_small = image_bgr
+    if W > INFER_W or H > INFER_H:
+        image_small = cv2.resize(image_bgr, (INFER_W, INFER_H), interpolation=cv2.INTER_AREA)
+    depth = estimate_depth(model, transform, image_small, device, depth_filter)
+    if depth.shape != (H, W):
+        depth = cv2.resize(depth, (W, H), interpolation=cv2.INTER_LINEAR)
     print(f"[green]Depth computed:[/] shape={depth.shape}, range=({depth.min():.3f},{depth.max():.3f})")
 
     K = infer_intrinsics(W, H)
-    pcd = depth_to_pointcloud(depth, K)
-    pcd = clean_pointcloud(pcd)
-    print(f"[green]Point cloud:[/] {np.asarray(pcd.points).shape[0]} points")
-
-    mesh = reconstruct_mesh(pcd)
+    if mesher == "grid":
+        mesh = mesh_from_depth(depth, K)
+    else:
+        pcd = depth_to_pointcloud(depth, K)
+        pcd = clean_pointcloud(pcd)
+        print(f"[green]Point cloud:[/] {len(pcd.point.positions)} points")
+        mesh = reconstruct_mesh(pcd, mesher)
     print(f"[green]Mesh:[/] {len(mesh.vertices)} vertices, {len(mesh.triangles)} faces")
 
     # UVs and texture
     uv = compute_uv(mesh, K, W, H)
 
-    # Save texture from original image
-    out_dir = output_dir
-    out_dir.mkdir(parents=True, exist_ok=True)
-    texture_path = out_dir / "texture.png"
-    Image.fromarray(cv2.cvtColor(image_bgr, cv2.COLOR_BGR2RGB)).save(texture_path)
-
-    obj_path, glb_path, tex_out = export_obj_glb(mesh, uv, texture_path, out_dir)
-    stats = write_stats(mesh, out_dir)
+    glb_bytes, obj_str, tex_bytes = export_obj_glb(mesh, uv, image_bgr)
+    return glb_bytes, obj_str, tex_bytes, mesh_stats(mesh)
+
+
+def run_single_image(
+    image_bgr: np.ndarray,
+    output_dir: Path,
+    model,
+    transform,
+    device: torch.device,
+    depth_filter: str = "guided",
+    mesher: str = "grid",
+):
+    """generate_model + write every output file to `output_dir`. Returns the stats dict."""
+    glb_bytes, obj_str, tex_bytes, stats = generate_model(
+        image_bgr, model, transform, device, depth_filter, mesher
+    )
+    obj_path, glb_path, tex_path, stats_path = save_outputs(output_dir, glb_bytes, obj_str, tex_bytes, stats)
 
     print(f"[cyan]OBJ:[/] {obj_path}")
     print(f"[cyan]GLB:[/] {glb_path}")
-    print(f"[cyan]Texture:[/] {tex_out}")
-    print(f"[cyan]Stats:[/] {out_dir / 'stats.json'}")
+    print(f"[cyan]Texture:[/] {tex_path}")
+    print(f"[cyan]Stats:[/] {stats_path}")
+    return stats
 
 
 def main():
@@ -291,12 +763,28 @@ def main():
     ap.add_argument("--input", required=True, help="Input image path")
     ap.add_argument("--output", required=True, help="Output folder")
     ap.add_argument("--mode", default="single_image", choices=["single_image"], help="Pipeline mode")
+    ap.add_argument("--engine", default="torch", choices=["torch", "onnxrt", "coreml"], help="Depth inference engine")
+    ap.add_argument("--onnx", help="Exported MiDaS ONNX model (for --engine onnxrt/coreml)")
+    ap.add_argument("--filter", default="guided", choices=DEPTH_FILTERS, help="Depth post-processing filter")
+    ap.add_argument("--mesher", default="grid", choices=MESHERS, help="Meshing: grid (direct from depth), poisson or bpa (ball pivoting)")
+    ap.add_argument("--precision", default="auto", choices=PRECISIONS, help="MiDaS compute precision for --engine torch (auto: fp16 on GPU, fp32 on CPU)")
+    ap.add_argument("--compile", action="store_true", help="torch.compile MiDaS before inference (slow start, faster forwards)")
+    ap.add_argument("--hub-dir", help="torch.hub cache directory (pre-populated for offline use)")
+    ap.add_argument("--onnx-model", default="DPT_Large", choices=list(MIDAS_NORMALIZATION), help="MiDaS variant the ONNX file was exported from")
     args = ap.parse_args()
 
     input_path = Path(args.input)
     output_dir = Path(args.output)
     if args.mode == "single_image":
-        run_single_image(input_path, output_dir)
+        image_bgr = cv2.imread(str(input_path))
+        if image_bgr is None:
+            raise FileNotFoundError(f"Failed to read image: {input_path}")
+        onnx_path = Path(args.onnx) if args.onnx else None
+        model, transform, device = load_depth_model(
+            args.engine, onnx_path, args.onnx_model, args.precision, args.compile, args.hub_dir
+        )
+        print(f"[green]Device:[/] {device} ({args.engine})")
+        run_single_image(image_bgr, output_dir, model, transform, device, args.filter, args.mesher)
     else:
         print("Unsupported mode.")
         sys.exit(2)
@@ -4,22 +4,152 @@ Flask API server for image-to-3D model generation.
 Accepts image uploads, runs MiDaS depth estimation + 3D reconstruction, returns model files.
 """
 
+import gzip
+import hashlib
+import io
 import os
-import sys
-import tempfile
+import queue
+import threading
+import time
+from concurrent.futures import Future
 from pathlib import Path
+
+# Deliberately placed between the stdlib and third-party imports: the OpenMP runtime
+# bundled with numpy/cv2/torch reads OMP_NUM_THREADS once, when the first of them is
+# imported, so setting it any later has no effect. setdefault keeps an operator's value.
+os.environ.setdefault('OMP_NUM_THREADS', str(os.cpu_count() or 1))
+
 from flask import Flask, request, jsonify, send_file
-from werkzeug.utils import secure_filename
-import subprocess
+import numpy as np
+import cv2
+import torch
+
+import predict
 
 app = Flask(__name__)
 app.config['MAX_CONTENT_LENGTH'] = 50 * 1024 * 1024  # 50MB max
 
+# Micro-batching: concurrent requests arriving within BATCH_WAIT_MS share one forward pass
+BATCH_MAX = int(os.environ.get('BATCH_MAX', '16'))
+BATCH_WAIT_MS = float(os.environ.get('BATCH_WAIT_MS', '15'))
+
+
+class MidasBatcher:
+    """Coalesces concurrent MiDaS forward passes into batched calls.
+
+    Callable like the model itself: takes a [1,3,H,W] tensor and blocks until
+    the batch it joined has run, returning its [1,H,W] slice. A single worker
+    thread owns the model, so forward passes are never reentrant.
+    """
+
+    def __init__(self, model, max_batch: int, max_wait_ms: float):
+        self.model = model
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="midas-batcher", daemon=True)
+        self._worker.start()
+
+    def __call__(self, inp):
+        future = Future()
+        self._queue.put((inp, future))
+        return future.result()
+
+    def _collect(self):
+        items = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(items) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                items.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return items
+
+    def _run(self):
+        while True:
+            items = self._collect()
+            # Transforms may keep aspect ratio, so only same-shaped inputs can be stacked
+            groups = {}
+            for inp, future in items:
+                groups.setdefault(tuple(inp.shape[1:]), []).append((inp, future))
+            for group in groups.values():
+                self._run_batch(group)
+
+    def _run_batch(self, group):
+        futures = [future for _, future in group]
+        try:
+            batch = torch.cat([inp for inp, _ in group], dim=0)
+            # Plain no_grad, as in compile_midas's warm-up: inference_mode tensors
+            # fail the compiled graph's guards and would trigger a recompile
+            with torch.no_grad():
+                pred = self.model(batch)
+        except Exception as e:
+            for future in futures:
+                future.set_exception(e)
+            return
+        # Each request gets its own copy rather than a view into the shared batch output
+        for future, out in zip(futures, pred.split(1, dim=0)):
+            future.set_result(out.clone())
+
+
+# Depth engine: "torch" (torch.hub MiDaS), or "onnxrt"/"coreml" with a pre-exported ONNX model
+MIDAS_ENGINE = os.environ.get('MIDAS_ENGINE', 'torch')
+MIDAS_ONNX = os.environ.get('MIDAS_ONNX')
+MIDAS_ONNX_MODEL = os.environ.get('MIDAS_ONNX_MODEL', 'DPT_Large')
+MIDAS_PRECISION = os.environ.get('MIDAS_PRECISION', 'auto')
+MIDAS_COMPILE = os.environ.get('MIDAS_COMPILE', '1') != '0'
+MIDAS_HUB_DIR = os.environ.get('MIDAS_HUB_DIR')
+DEPTH_FILTER = os.environ.get('DEPTH_FILTER', 'guided')
+MESHER = os.environ.get('MESHER', 'grid')
+
+# GLB responses are gzip-compressed for clients that accept it (JSON chunk and
+# mesh buffers compress well); set GLB_GZIP_LEVEL=0 to disable.
+GLB_GZIP_LEVEL = int(os.environ.get('GLB_GZIP_LEVEL', '6'))
+
+# SIMD dispatch decides how fast the OpenCV filters run (predict sets the thread count)
+cv2.setUseOptimized(True)
+predict.log_opencv_build()
+
+# Load MiDaS once per process and reuse it across requests
+_midas_model, app.config['MIDAS_TRANSFORM'], app.config['MIDAS_DEVICE'] = predict.load_depth_model(
+    MIDAS_ENGINE,
+    Path(MIDAS_ONNX) if MIDAS_ONNX else None,
+    MIDAS_ONNX_MODEL,
+    MIDAS_PRECISION,
+    MIDAS_COMPILE,
+    MIDAS_HUB_DIR,
+    BATCH_MAX,
+)
+app.config['MIDAS_MODEL'] = MidasBatcher(_midas_model, BATCH_MAX, BATCH_WAIT_MS)
+
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def decode_upload(data):
+    """Decode uploaded image bytes into a BGR array without touching disk."""
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+def model_etag(data):
+    """Content-addressed ETag: same image + same pipeline settings → same model."""
+    settings = f"{MIDAS_ENGINE}|{MIDAS_ONNX}|{MIDAS_ONNX_MODEL}|{MIDAS_PRECISION}|{DEPTH_FILTER}|{MESHER}".encode()
+    return hashlib.sha256(settings + b"\0" + data).hexdigest()
+
+def run_pipeline(image_bgr):
+    """Returns (glb_bytes, obj_str, tex_bytes, stats), all in memory."""
+    return predict.generate_model(
+        image_bgr,
+        app.config['MIDAS_MODEL'],
+        app.config['MIDAS_TRANSFORM'],
+        app.config['MIDAS_DEVICE'],
+        DEPTH_FILTER,
+        MESHER,
+    )
+
 @app.route('/health', methods=['GET'])
 def health():
     return jsonify({"status": "ok", "service": "image-to-3d"})
@@ -27,7 +157,7 @@ def health():
 @app.route('/generate', methods=['POST'])
 def generate_3d():
     """
-    Accept image upload, run predict.py, return URLs to download generated files.
+    Accept image upload, run the in-process pipeline, return URLs to download generated files.
     """
     if 'image' not in request.files:
         return jsonify({"error": "No image file provided"}), 400
@@ -39,72 +169,31 @@ def generate_3d():
     if not allowed_file(file.filename):
         return jsonify({"error": f"Invalid file type. Allowed: {ALLOWED_EXTENSIONS}"}), 400
     
-    # Save uploaded file
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_path = Path(tmpdir) / secure_filename(file.filename)
-        output_dir = Path(tmpdir) / "out"
-        output_dir.mkdir(exist_ok=True)
-        
-        file.save(str(input_path))
-        print(f"📥 Received image: {input_path}")
+    image_bgr = decode_upload(file.read())
+    if image_bgr is None:
+        return jsonify({"error": "Could not decode image"}), 400
+    print(f"📥 Received image: {file.filename}")
+    
+    try:
+        glb_bytes, obj_str, tex_bytes, stats = run_pipeline(image_bgr)
+        print(f"✅ 3D model generated successfully")
         
-        # Run predict.py
-        script_dir = Path(__file__).parent
-        predict_script = script_dir / "predict.py"
+        # Return file info (in production, you'd save these and provide download URLs)
+        return jsonify({
+            "status": "success",
+            "message": "3D model generated",
+            "files": ['obj', 'glb', 'texture', 'stats'],
+            "stats": stats
+        })
         
-        try:
-            result = subprocess.run(
-                [sys.executable, str(predict_script), 
-                 "--input", str(input_path),
-                 "--output", str(output_dir)],
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
-            
-            if result.returncode != 0:
-                print(f"❌ predict.py failed:\n{result.stderr}")
-                return jsonify({"error": "3D generation failed", "details": result.stderr}), 500
-            
-            print(f"✅ 3D model generated successfully")
-            print(result.stdout)
-            
-            # Read generated files
-            obj_path = output_dir / "model.obj"
-            glb_path = output_dir / "model.glb"
-            texture_path = output_dir / "texture.png"
-            stats_path = output_dir / "stats.json"
-            
-            # Check what files were generated
-            generated_files = {}
-            if obj_path.exists():
-                generated_files['obj'] = obj_path.read_bytes()
-            if glb_path.exists():
-                generated_files['glb'] = glb_path.read_bytes()
-            if texture_path.exists():
-                generated_files['texture'] = texture_path.read_bytes()
-            if stats_path.exists():
-                import json
-                generated_files['stats'] = json.loads(stats_path.read_text())
-            
-            # Return file info (in production, you'd save these and provide download URLs)
-            return jsonify({
-                "status": "success",
-                "message": "3D model generated",
-                "files": list(generated_files.keys()),
-                "stats": generated_files.get('stats', {})
-            })
-            
-        except subprocess.TimeoutExpired:
-            return jsonify({"error": "Processing timeout (>2 minutes)"}), 500
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        print(f"❌ Error: {e}")
+        return jsonify({"error": str(e)}), 500
 
 @app.route('/generate-sync', methods=['POST'])
 def generate_3d_sync():
     """
-    Accept image upload, run predict.py, return the GLB file directly.
+    Accept image upload, run the in-process pipeline, return the GLB file directly.
     """
     if 'image' not in request.files:
         return jsonify({"error": "No image file provided"}), 400
@@ -113,43 +202,50 @@ def generate_3d_sync():
     if file.filename == '' or not allowed_file(file.filename):
         return jsonify({"error": "Invalid file"}), 400
     
-    with tempfile.TemporaryDirectory() as tmpdir:
-        input_path = Path(tmpdir) / secure_filename(file.filename)
-        output_dir = Path(tmpdir) / "out"
-        output_dir.mkdir(exist_ok=True)
-        
-        file.save(str(input_path))
+    data = file.read()
+    # Quality-aware: "gzip;q=0" means not acceptable
+    use_gzip = GLB_GZIP_LEVEL > 0 and request.accept_encodings['gzip'] > 0
+    # gzip and identity bodies differ byte-for-byte, so they need distinct strong ETags
+    etag = model_etag(data) + ('-gz' if use_gzip else '')
+    # The client already holds the model generated from this exact upload.
+    # `If-None-Match: *` matches any ETag, which would 304 an upload never generated.
+    if not request.if_none_match.star_tag and request.if_none_match.contains(etag):
+        response = app.response_class(status=304)
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        return response
+    
+    image_bgr = decode_upload(data)
+    if image_bgr is None:
+        return jsonify({"error": "Could not decode image"}), 400
+    
+    try:
+        glb_bytes, _, _, _ = run_pipeline(image_bgr)
         
-        script_dir = Path(__file__).parent
-        predict_script = script_dir / "predict.py"
+        if use_gzip:
+            glb_bytes = gzip.compress(glb_bytes, compresslevel=GLB_GZIP_LEVEL)
         
-        try:
-            result = subprocess.run(
-                [sys.executable, str(predict_script), 
-                 "--input", str(input_path),
-                 "--output", str(output_dir)],
-                capture_output=True,
-                text=True,
-                timeout=120
-            )
+        # Stream the GLB straight from memory
+        buf = io.BytesIO(glb_bytes)
+        buf.seek(0)
+        response = send_file(
+            buf,
+            mimetype='model/gltf-binary',
+            as_attachment=True,
+            download_name='model.glb'
+        )
+        if use_gzip:
+            response.headers['Content-Encoding'] = 'gzip'
+        response.vary.add('Accept-Encoding')
+        response.set_etag(etag)
+        # send_file defaults to no-cache; the ETag already pins the content
+        response.cache_control.no_cache = None
+        response.cache_control.private = True
+        response.cache_control.max_age = 86400
+        return response
             
-            if result.returncode != 0:
-                return jsonify({"error": "Generation failed", "details": result.stderr}), 500
-            
-            # Return GLB file
-            glb_path = output_dir / "model.glb"
-            if glb_path.exists():
-                return send_file(
-                    str(glb_path),
-                    mimetype='model/gltf-binary',
-                    as_attachment=True,
-                    download_name='model.glb'
-                )
-            else:
-                return jsonify({"error": "GLB file not generated"}), 500
-                
-        except Exception as e:
-            return jsonify({"error": str(e)}), 500
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
 
 if __name__ == '__main__':
     print("🚀 Starting Image-to-3D API server...")
@@ -157,4 +253,5 @@ if __name__ == '__main__':
     print("  GET  /health - Health check")
     print("  POST /generate - Generate 3D (returns JSON with file info)")
     print("  POST /generate-sync - Generate 3D (returns GLB file directly)")
-    app.run(host='0.0.0.0', port=5001, debug=True)
+    # The reloader would fork a second process and load MiDaS twice
+    app.run(host='0.0.0.0', port=5001, debug=True, use_reloader=False)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""Point-cloud meshing path: depth_to_pointcloud → clean_pointcloud → reconstruct_mesh."""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import predict  # noqa: E402
+
+
+def smooth_depth(h=120, w=160):
+    # Gently curved surface so Poisson and ball pivoting both have something to fit
+    v, u = np.mgrid[0:h, 0:w].astype(np.float32)
+    return (0.5 + 0.1 * np.sin(u / w * np.pi) * np.cos(v / h * np.pi)).astype(np.float32)
+
+
+def test_clean_pointcloud_keeps_normals():
+    depth = smooth_depth()
+    K = predict.infer_intrinsics(depth.shape[1], depth.shape[0])
+    pcd = predict.clean_pointcloud(predict.depth_to_pointcloud(depth, K))
+    assert "normals" in pcd.point
+    normals = pcd.point.normals.cpu().numpy()
+    assert len(normals) == len(pcd.point.positions) > 0
+    np.testing.assert_allclose(np.linalg.norm(normals, axis=1), 1.0, atol=1e-4)
+
+
+@pytest.mark.parametrize("method", ["poisson", "bpa"])
+def test_reconstruct_mesh(method):
+    depth = smooth_depth()
+    K = predict.infer_intrinsics(depth.shape[1], depth.shape[0])
+    pcd = predict.clean_pointcloud(predict.depth_to_pointcloud(depth, K))
+    mesh = predict.reconstruct_mesh(pcd, method)
+    assert 0 < len(mesh.triangles) <= predict.MAX_FACES
+    assert mesh.has_vertex_normals()